@@ -24,7 +24,7 @@ parser = argparse.ArgumentParser(
     description="Command line interface for BM Auth biometric authentication",
     formatter_class=argparse.RawDescriptionHelpFormatter,
     prog="bm_auth",
-    usage="bm_auth [-U USER] [--plain] [-y] {face,voice} {add,remove,list} ...",
+    usage="bm_auth [-U USER] [--plain] [-y] {face,voice} {add,remove,list,import,calibrate} ...",
     epilog="For support please visit\nhttps://github.com/vareee/bm_auth",
     add_help=False
 )
@@ -37,15 +37,15 @@ parser.add_argument(
     choices=["face", "voice"]
 )
 
-# Subcommand: add / remove / list
+# Subcommand: add / remove / list / import / calibrate
 parser.add_argument(
     "subcommand",
     help="Action to perform",
     metavar="action",
-    choices=["add", "remove", "list"]
+    choices=["add", "remove", "list", "import", "calibrate"]
 )
 
-# Optional args for add/remove
+# Optional args for add/remove/import
 parser.add_argument(
     "arguments",
     help="Optional arguments for some commands",
@@ -98,6 +98,8 @@ script_map = {
     ("face", "add"): "ref_face.py",
     ("face", "remove"): "del_face.py",
     ("face", "list"): "list_face.py",
+    ("face", "import"): "import_face.py",
+    ("face", "calibrate"): "calibrate_face.py",
     ("voice", "add"): "ref_voice.py",
     ("voice", "remove"): "del_voice.py",
 }
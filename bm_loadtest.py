@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Load generator for the PAM modules: many concurrent authentications with replayed inputs
+import os
+import sys
+import math
+import time
+import glob
+import types
+import shutil
+import tempfile
+import resource
+import argparse
+import multiprocessing
+
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = {
+    "face": ("face_auth", "pam_face_auth"),
+    "voice": ("voice_auth", "pam_voice_aith"),
+    "mfa": ("", "pam_mfa_auth"),
+}
+
+
+class FakePamh:
+    """Stand-in for the pam_python handle, messages are kept instead of shown"""
+
+    PAM_SUCCESS = 0
+    PAM_SYSTEM_ERR = 4
+    PAM_AUTH_ERR = 7
+    PAM_USER_UNKNOWN = 10
+    PAM_ERROR_MSG = 3
+    PAM_TEXT_INFO = 4
+
+    class Message:
+        def __init__(self, msg_style, msg):
+            self.msg_style = msg_style
+            self.msg = msg
+
+    def __init__(self, user):
+        self.user = user
+        self.messages = []
+
+    def get_user(self, prompt=None):
+        return self.user
+
+    def conversation(self, message):
+        self.messages.append((message.msg_style, message.msg))
+
+
+class ReplayVideoCapture:
+    """Replacement for howdy's VideoCapture reading frames from a video file or image directory"""
+
+    source = None
+    fps = 30
+
+    def __init__(self, config):
+        import cv2
+        self.cv2 = cv2
+        self.frames = None
+        self.index = 0
+        self.next_time = time.perf_counter()
+
+        if os.path.isdir(self.source):
+            paths = sorted(glob.glob(os.path.join(self.source, "*")))
+            self.frames = [f for f in (cv2.imread(p) for p in paths) if f is not None]
+            if not self.frames:
+                raise OSError(f"No readable images in {self.source}")
+        else:
+            self.capture = cv2.VideoCapture(self.source)
+            if not self.capture.isOpened():
+                raise OSError(f"Can't open video {self.source}")
+
+    def read_frame(self):
+        # Pace the frames like a real camera would
+        delay = self.next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_time = max(self.next_time, time.perf_counter()) + 1 / self.fps
+
+        if self.frames is not None:
+            frame = self.frames[self.index % len(self.frames)]
+            self.index += 1
+        else:
+            ok, frame = self.capture.read()
+            if not ok:
+                self.capture.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self.capture.read()
+            if not ok:
+                return None, None
+
+        return frame, self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2GRAY)
+
+    def release(self):
+        if self.frames is None:
+            self.capture.release()
+
+
+def install_replay(args, stats_dir):
+    """Point the PAM modules at the replayed camera and microphone"""
+    # Sessions must not touch the user's real authentication history
+    import auth_stats
+    auth_stats.STATS_DIR = stats_dir
+
+    if args.module in ("face", "mfa"):
+        # The replayed video shows one head pose, so the random challenge must match it
+        import pam_face_auth
+        pam_face_auth.random = types.SimpleNamespace(choice=lambda directions: args.direction)
+
+    if args.video:
+        ReplayVideoCapture.source = args.video
+        ReplayVideoCapture.fps = args.fps
+        recorders = types.ModuleType("recorders")
+        video_capture = types.ModuleType("recorders.video_capture")
+        video_capture.VideoCapture = ReplayVideoCapture
+        recorders.video_capture = video_capture
+        sys.modules["recorders"] = recorders
+        sys.modules["recorders.video_capture"] = video_capture
+
+    if args.audio and args.module in ("voice", "mfa"):
+        import numpy as np
+        import pam_voice_aith
+
+        if args.audio.endswith(".npy"):
+            audio = np.load(args.audio).astype("float32")
+        else:
+            import librosa
+            audio, _ = librosa.load(args.audio, sr=16000)
+
+        def capture_audio(duration=7, sample_rate=16000, cancel=None):
+            # Take as long as the real recording would
+            if cancel is None:
+                time.sleep(duration)
+            elif cancel.wait(duration):
+                return None
+            return audio[:int(duration * sample_rate)]
+
+        pam_voice_aith.capture_audio = capture_audio
+        if args.phrase:
+            pam_voice_aith.generate_random_word = lambda: args.phrase
+
+
+def run_session(args):
+    """Run one authentication in this process, return (status, seconds, peak RSS in KiB, error)"""
+    module_dir, module_name = MODULES[args.module]
+    sys.path.insert(0, os.path.join(base_dir, "face_auth"))
+    sys.path.insert(0, os.path.join(base_dir, "voice_auth"))
+    sys.path.insert(0, os.path.join(base_dir, module_dir))
+    if args.vosk_dir:
+        os.chdir(args.vosk_dir)
+
+    pamh = FakePamh(args.user)
+    error = None
+    stats_dir = tempfile.mkdtemp(prefix="bm_loadtest-")
+    start = time.perf_counter()
+    try:
+        install_replay(args, stats_dir)
+        module = __import__(module_name)
+        status = module.pam_sm_authenticate(pamh, 0, [module_name] + args.pam_args)
+    except Exception as e:
+        status = pamh.PAM_SYSTEM_ERR
+        error = str(e)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(stats_dir, ignore_errors=True)
+
+    # The modules report their own errors through the conversation
+    if error is None and status == pamh.PAM_SYSTEM_ERR:
+        error = next((msg for style, msg in reversed(pamh.messages) if style == pamh.PAM_ERROR_MSG), None)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return status, elapsed, peak_rss, error
+
+
+def percentile(values, q):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def run_batch(args, sessions, concurrency):
+    # One fresh process per session, like sudo or login would start
+    context = multiprocessing.get_context("fork")
+    with context.Pool(concurrency, maxtasksperchild=1) as pool:
+        start = time.perf_counter()
+        results = pool.map(run_session, [args] * sessions, chunksize=1)
+        wall = time.perf_counter() - start
+    return results, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate many concurrent PAM authentications with replayed camera and microphone input",
+        prog="bm_loadtest"
+    )
+    parser.add_argument("module", choices=list(MODULES), help="PAM module to load")
+    parser.add_argument("-U", "--user", required=True, help="User to authenticate")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Sessions running at the same time")
+    parser.add_argument("-n", "--sessions", type=int, default=32, help="Total number of sessions")
+    parser.add_argument("--video", help="Video file or directory of images replayed as the camera")
+    parser.add_argument("--fps", type=float, default=30, help="Replay rate of the camera")
+    parser.add_argument("--audio", help=".npy or audio file replayed as the microphone")
+    parser.add_argument("--direction", choices=["Front", "Left", "Right"],
+                        help="Head pose shown in the replayed video, required for face and mfa")
+    parser.add_argument("--phrase", help="Challenge phrase spoken in the replayed audio, required for voice and mfa")
+    parser.add_argument("--vosk-dir", help="Directory containing the Vosk model folder")
+    parser.add_argument("pam_args", nargs="*", help="Arguments passed to the PAM module, e.g. policy=any")
+    args = parser.parse_args()
+
+    # Sessions chdir into the Vosk directory, relative paths must not follow them
+    if args.video:
+        args.video = os.path.abspath(args.video)
+        try:
+            ReplayVideoCapture.source = args.video
+            ReplayVideoCapture(None).release()
+        except OSError as e:
+            parser.error(str(e))
+    if args.audio:
+        args.audio = os.path.abspath(args.audio)
+        if not os.path.isfile(args.audio):
+            parser.error(f"Audio file does not exist: {args.audio}")
+
+    # Random challenges would make sessions fail regardless of load
+    if args.module in ("face", "mfa") and not args.direction:
+        parser.error("--direction is required so every session gets the pose shown in the video")
+    if args.module in ("voice", "mfa") and not args.phrase:
+        parser.error("--phrase is required so every session asks for the phrase in the audio")
+
+    # A single session first, so failures under load can be told apart from failures of the input
+    print("Running a baseline session...")
+    baseline, _ = run_batch(args, 1, 1)
+    baseline_status, baseline_time, baseline_rss, baseline_error = baseline[0]
+    print(f"Baseline: status {baseline_status}, {baseline_time:.2f}s, {baseline_rss / 1024:.0f} MiB"
+          + (f", error: {baseline_error}" if baseline_error else ""))
+
+    print(f"\nRunning {args.sessions} sessions, {args.concurrency} at a time...")
+    results, wall = run_batch(args, args.sessions, args.concurrency)
+
+    latencies = [elapsed for _, elapsed, _, _ in results]
+    rss = [peak for _, _, peak, _ in results]
+    succeeded = sum(1 for status, _, _, _ in results if status == FakePamh.PAM_SUCCESS)
+    errors = [error for status, _, _, error in results if status == FakePamh.PAM_SYSTEM_ERR]
+    # Anything that differs from the baseline outcome is blamed on contention
+    contention = sum(1 for status, _, _, _ in results if status != baseline_status)
+
+    print(f"\nThroughput: {len(results) / wall:.2f} sessions/s ({wall:.1f}s wall)")
+    print(f"Latency:    p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  "
+          f"p99 {percentile(latencies, 99):.2f}s  max {max(latencies):.2f}s")
+    print(f"Peak RSS:   median {percentile(rss, 50) / 1024:.0f} MiB  max {max(rss) / 1024:.0f} MiB per session")
+    print(f"Outcome:    {succeeded} succeeded, {len(results) - succeeded} failed, "
+          f"{len(errors)} system errors, {contention} differ from baseline")
+
+    for error in sorted(set(e for e in errors if e)):
+        print(f"  {errors.count(error)}x {error}")
+
+    sys.exit(1 if contention else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Per user history of which face models unlocked, used to order the auth loop
+import os
+import json
+import tempfile
+
+from frame_governor import MIN_TRIALS
+
+
+STATS_DIR = "/usr/local/etc/bm_auth/face_auth/stats"
+
+# A model tried this many times without a single hit, while another model
+# of the same direction does unlock, is considered stale
+STALE_ATTEMPTS = 5
+# Stale models get this share of the normal trial budget, but no less than MIN_TRIALS
+STALE_TRIALS_FACTOR = 0.25
+
+
+class AuthStats:
+    """Authentication history of one user.
+
+    Stored as JSON with per model counters (attempts, hits, trials and
+    frames spent on successful unlocks) and per direction counters.
+    """
+
+    def __init__(self, user, data=None):
+        self.user = user
+        self.data = data or {"models": {}, "directions": {}}
+
+    @property
+    def path(self):
+        return os.path.join(STATS_DIR, f"{self.user}.json")
+
+    @classmethod
+    def load(cls, user):
+        stats = cls(user)
+        try:
+            stats.data = json.load(open(stats.path))
+        except (FileNotFoundError, ValueError):
+            pass
+        return stats
+
+    def save(self):
+        os.makedirs(STATS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=STATS_DIR, prefix=".stats-")
+        try:
+            with os.fdopen(fd, "w") as statsfile:
+                json.dump(self.data, statsfile)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def model(self, model_id):
+        return self.data["models"].get(str(model_id), {"attempts": 0, "hits": 0, "trials": 0, "frames": 0})
+
+    def hit_rate(self, model_id):
+        """Smoothed success rate, untried models start at 0.5"""
+        entry = self.model(model_id)
+        return (entry["hits"] + 1) / (entry["attempts"] + 2)
+
+    def is_stale(self, model_id, peer_ids):
+        """Stale only relative to peers, failed logins alone demote nothing"""
+        entry = self.model(model_id)
+        if entry["attempts"] < STALE_ATTEMPTS or entry["hits"] > 0:
+            return False
+        return any(self.model(peer)["hits"] > 0 for peer in peer_ids if peer != model_id)
+
+    def order(self, models):
+        """Models most likely to unlock first, file order between equals"""
+        return sorted(models, key=lambda m: -self.hit_rate(m["id"]))
+
+    def trials_for(self, model_id, trials, peer_ids):
+        """Trial budget for a model, peer_ids are the models of the same direction"""
+        if self.is_stale(model_id, peer_ids):
+            # A spent budget stays 0, so the caller still skips the model
+            return min(trials, max(MIN_TRIALS, int(trials * STALE_TRIALS_FACTOR)))
+        return trials
+
+    def record(self, direction, tried_ids, hit_id=None, trials=0, frames=0):
+        """Add one authentication attempt to the history"""
+        entry = self.data["directions"].setdefault(direction, {"attempts": 0, "hits": 0})
+        entry["attempts"] += 1
+        if hit_id is not None:
+            entry["hits"] += 1
+
+        for model_id in tried_ids:
+            entry = self.data["models"].setdefault(str(model_id), self.model(model_id))
+            entry["attempts"] += 1
+            if model_id == hit_id:
+                entry["hits"] += 1
+                entry["trials"] += trials
+                entry["frames"] += frames
+
+    def forget(self, model_id):
+        self.data["models"].pop(str(model_id), None)
@@ -0,0 +1,238 @@
+# Measure camera and model performance on this host and tune config.ini for it
+import os
+import sys
+import json
+import math
+import time
+import random
+import tempfile
+import glob
+import configparser
+import numpy as np
+
+# Try to import dlib and give a nice error if we can't
+try:
+    import dlib
+except ImportError as err:
+    print(err)
+    print("Can't import the dlib module, check the output of")
+    print("pip3 show dlib")
+    sys.exit(1)
+
+# OpenCV needs to be imported after dlib
+import cv2
+
+sys.path.append("/usr/local/lib/x86_64-linux-gnu/howdy")
+from recorders.video_capture import VideoCapture
+from vault_utils import PRIME, DEGREE, search_vault, pool_size_for
+from face_detection import CNN_MODEL_PATH
+import resource_cache
+
+
+CONFIG_PATH = "/usr/local/etc/bm_auth/face_auth/config.ini"
+SCALES = (1.0, 0.75, 0.5)
+SAMPLE_FRAMES = 30
+# Give up if the camera delivers nothing for this long
+CAMERA_TIMEOUT = 10
+MODELS_DIR = "/usr/local/etc/bm_auth/face_auth/models"
+
+# Time pam_face_auth sleeps after asking the user to turn their head
+PROMPT_DELAY = 2
+# How many processed frames a login usually needs, and how many the timeout should allow
+EXPECTED_FRAMES = 3
+TIMEOUT_FRAMES = 12
+# Share of a frame's processing time the vault search may take per model
+UNLOCK_BUDGET = 0.3
+
+
+def timed(func, repeat=3):
+    """Return the best wall time of func over repeat runs, and its last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure_camera(config):
+    print("Measuring camera, please look into it...")
+    start = time.perf_counter()
+    video_capture = VideoCapture(config)
+
+    frame = None
+    while frame is None:
+        if time.perf_counter() - start > CAMERA_TIMEOUT:
+            video_capture.release()
+            print(f"The camera delivered no frame within {CAMERA_TIMEOUT}s, check the video settings in config.ini")
+            sys.exit(1)
+        frame, gsframe = video_capture.read_frame()
+    warmup = time.perf_counter() - start
+
+    frames = []
+    darkness = []
+    start = time.perf_counter()
+    while len(frames) < SAMPLE_FRAMES:
+        if time.perf_counter() - start > CAMERA_TIMEOUT:
+            video_capture.release()
+            print(f"The camera stopped delivering frames after {len(frames)} of {SAMPLE_FRAMES}")
+            sys.exit(1)
+        frame, gsframe = video_capture.read_frame()
+        if frame is None:
+            continue
+        frames.append(frame)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [8], [0, 256])
+        darkness.append(float(hist[0][0] / np.sum(hist) * 100))
+    fps = SAMPLE_FRAMES / (time.perf_counter() - start)
+
+    video_capture.release()
+    return warmup, fps, frames, darkness
+
+
+def measure_models(frames):
+    hog = dlib.get_frontal_face_detector()
+    cnn = dlib.cnn_face_detection_model_v1(CNN_MODEL_PATH) if os.path.exists(CNN_MODEL_PATH) else None
+    pose_predictor = dlib.shape_predictor("/usr/local/share/dlib-data/shape_predictor_5_face_landmarks.dat")
+    face_encoder = dlib.face_recognition_model_v1("/usr/local/share/dlib-data/dlib_face_recognition_resnet_model_v1.dat")
+
+    frame = frames[len(frames) // 2]
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    detectors = {}
+    for scale in SCALES:
+        scaled = cv2.resize(gray, None, fx=scale, fy=scale) if scale != 1.0 else gray
+        for upsample in (0, 1):
+            detectors[("hog", scale, upsample)] = timed(lambda: hog(scaled, upsample))
+            if cnn is not None:
+                detectors[("cnn", scale, upsample)] = timed(lambda: cnn(scaled, upsample), repeat=1)
+
+    # Landmarks and descriptor need a face, take it from the slowest but most sensitive run
+    faces = detectors[("hog", 1.0, 1)][1]
+    if not faces:
+        print("No face found in the sample frames, landmark and encoder timings are skipped")
+        return detectors, 0, 0
+
+    landmark_time, landmarks = timed(lambda: pose_predictor(frame, faces[0]))
+    encoder_time, _ = timed(lambda: face_encoder.compute_face_descriptor(frame, landmarks, 1))
+    return detectors, landmark_time, encoder_time
+
+
+def measure_unlock(trials=300):
+    # A random vault never unlocks, the pool of DEGREE + 8 points has far more than `trials` subsets
+    vault = {
+        "points": [(random.randint(0, PRIME - 1), random.randint(0, PRIME - 1)) for _ in range(100)],
+        "hash": ""
+    }
+    candidates = [random.randint(0, PRIME - 1) for _ in range(10)]
+    elapsed, (_, trials_run) = timed(lambda: search_vault(vault, candidates, DEGREE, trials, DEGREE + 8), repeat=1)
+    return elapsed / max(1, trials_run)
+
+
+def count_models():
+    """Most models any user has for one direction, the settings apply to all users"""
+    most = 1
+    for enc_file in glob.glob(os.path.join(MODELS_DIR, "*.dat")):
+        try:
+            models = json.load(open(enc_file))
+        except (OSError, ValueError):
+            continue
+
+        # pam_face_auth only tries the models of one direction per login
+        per_direction = {}
+        for model in models:
+            for direction in ("Front", "Left", "Right"):
+                if f"({direction})" in model["label"]:
+                    per_direction[direction] = per_direction.get(direction, 0) + 1
+        most = max(most, max(per_direction.values(), default=1))
+    return most
+
+
+def write_config_atomic(config):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CONFIG_PATH), prefix=".calibrate-")
+    try:
+        with os.fdopen(fd, "w") as configfile:
+            config.write(configfile)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, CONFIG_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read(CONFIG_PATH)
+
+    warmup, fps, frames, darkness = measure_camera(config)
+    print(f"Camera: {fps:.1f} fps, {warmup * 1000:.0f} ms until the first frame")
+
+    detectors, landmark_time, encoder_time = measure_models(frames)
+    print("\nDetector latency (ms):")
+    print("\033[1;29m" + "Type  Scale  Upsample  Time\033[0m")
+    for (kind, scale, upsample), (elapsed, _) in sorted(detectors.items()):
+        print(f"{kind:<6}{scale:<7}{upsample:<10}{elapsed * 1000:.1f}")
+    print(f"\nLandmarks: {landmark_time * 1000:.1f} ms, encoder: {encoder_time * 1000:.1f} ms")
+
+    per_trial = measure_unlock()
+    print(f"Vault search: {per_trial * 1e6:.0f} us per trial")
+
+    frame_interval = 1 / fps
+    max_latency = config.getfloat("core", "cnn_max_latency", fallback=250) / 1000
+
+    # Prefer the CNN when it runs full size within the latency limit, it handles turned heads better
+    cnn_time = detectors.get(("cnn", 1.0, 0), (None,))[0]
+    use_cnn = cnn_time is not None and cnn_time <= max_latency
+    upsample = 0
+    if use_cnn:
+        detect_time = cnn_time
+    else:
+        # Upsampling finds smaller faces, keep it if HOG still fits in a few frame intervals
+        detect_time = detectors[("hog", 1.0, 1)][0]
+        if detect_time <= 3 * frame_interval:
+            upsample = 1
+        else:
+            detect_time = detectors[("hog", 1.0, 0)][0]
+
+    frame_cost = max(frame_interval, detect_time + landmark_time + encoder_time)
+
+    # Spend a fixed share of the frame cost on every model's vault search
+    models = count_models()
+    trials = int(max(500, min(20000, UNLOCK_BUDGET * frame_cost / per_trial)))
+    top_k = pool_size_for(trials, DEGREE)
+
+    unlock_cost = models * trials * per_trial
+    processed_frame = frame_cost + unlock_cost
+    timeout = max(3, math.ceil(warmup + TIMEOUT_FRAMES * processed_frame))
+
+    dark_threshold = min(95, max(50, np.percentile(darkness, 90) + 15))
+    clip_limit = 3.0 if np.median(darkness) > 30 else 2.0
+
+    values = {
+        ("core", "use_cnn"): str(use_cnn).lower(),
+        ("core", "upsample"): str(upsample),
+        ("video", "timeout"): str(timeout),
+        ("video", "dark_threshold"): f"{dark_threshold:.0f}",
+        ("clahe", "clip_limit"): f"{clip_limit:.1f}",
+        ("clahe", "tile_grid_size"): "8",
+        ("vault", "trials"): str(trials),
+        ("vault", "top_k"): str(top_k),
+    }
+
+    print("\nTuned settings:")
+    for (section, key), value in values.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        old = config.get(section, key, fallback="-")
+        print(f"  {section}.{key}: {old} -> {value}")
+        config.set(section, key, value)
+
+    write_config_atomic(config)
+    resource_cache.invalidate(CONFIG_PATH)
+    print(f"\nSaved to {CONFIG_PATH} (comments in the file are not kept)")
+
+    expected = PROMPT_DELAY + warmup + EXPECTED_FRAMES * processed_frame
+    print(f"Expected login latency: {expected:.1f}s (up to {models} models per direction), timeout {timeout}s")
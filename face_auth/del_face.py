@@ -3,6 +3,8 @@ import sys
 import os
 import json
 import builtins
+from auth_stats import AuthStats
+import resource_cache
 
 
 user = builtins.bm_user
@@ -81,3 +83,11 @@ else:
                 json.dump(new_encodings, datafile)
 
         print("Removed model {}".format(id))
+
+# Let running PAM hosts reload the vaults
+resource_cache.invalidate(enc_file)
+
+# Drop the history of the removed model, its ID may be given to a new one
+stats = AuthStats.load(user)
+stats.forget(id)
+stats.save()
@@ -0,0 +1,78 @@
+# Face detection stage that picks between the HOG and CNN detectors at runtime
+import os
+import time
+import dlib
+import resource_cache
+
+
+CNN_MODEL_PATH = "/usr/local/share/dlib-data/mmod_human_face_detector.dat"
+
+
+class FaceDetector:
+    """Detect faces with HOG or CNN depending on how fast this host is.
+
+    With core.use_cnn enabled frames are run through the CNN in batches of
+    core.cnn_batch_size. If the measured CNN latency per frame goes over
+    core.cnn_max_latency (ms) the detector switches to HOG for the rest of
+    the session. With core.cnn_fallback enabled, HOG mode tries the CNN on
+    frames where HOG found nothing, while it stays under the same latency
+    limit.
+    """
+
+    def __init__(self, config):
+        self.hog = resource_cache.cached("hog", "builtin", lambda path: dlib.get_frontal_face_detector())
+        self.cnn = None
+
+        use_cnn = config.getboolean("core", "use_cnn", fallback=False)
+        cnn_fallback = config.getboolean("core", "cnn_fallback", fallback=False)
+        if (use_cnn or cnn_fallback) and os.path.exists(CNN_MODEL_PATH):
+            self.cnn = resource_cache.get_model(dlib.cnn_face_detection_model_v1, CNN_MODEL_PATH)
+
+        self.mode = "cnn" if use_cnn and self.cnn is not None else "hog"
+        self.cnn_batch_size = max(1, config.getint("core", "cnn_batch_size", fallback=4))
+        self.max_latency = config.getfloat("core", "cnn_max_latency", fallback=250) / 1000
+        self.cnn_latency = None
+        self.hog_latency = None
+
+    @property
+    def batch_size(self):
+        """How many frames the caller should buffer before calling detect()"""
+        return self.cnn_batch_size if self.mode == "cnn" else 1
+
+    def _track(self, name, value):
+        # Exponential moving average of the per frame latency
+        previous = getattr(self, name)
+        setattr(self, name, value if previous is None else 0.7 * previous + 0.3 * value)
+
+    def _run_cnn(self, images, upsample):
+        start = time.perf_counter()
+        if len(images) == 1:
+            detections = [self.cnn(images[0], upsample)]
+        else:
+            detections = self.cnn(images, upsample, batch_size=len(images))
+        self._track("cnn_latency", (time.perf_counter() - start) / len(images))
+        return [[d.rect for d in faces] for faces in detections]
+
+    def detect(self, images, upsample=1):
+        """Return a list of dlib.rectangle lists, one per input image.
+
+        Images in one call must share the same size when running the CNN.
+        """
+        if self.mode == "cnn":
+            results = self._run_cnn(images, upsample)
+            if self.cnn_latency > self.max_latency:
+                self.mode = "hog"
+            return results
+
+        results = []
+        for image in images:
+            start = time.perf_counter()
+            faces = list(self.hog(image, upsample))
+            self._track("hog_latency", time.perf_counter() - start)
+
+            cnn_affordable = self.cnn_latency is None or self.cnn_latency <= self.max_latency
+            if not faces and self.cnn is not None and cnn_affordable:
+                faces = self._run_cnn([image], upsample)[0]
+
+            results.append(faces)
+        return results
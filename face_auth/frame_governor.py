@@ -0,0 +1,100 @@
+# Keeps the face auth loop inside its time budget and bounds its CPU use
+import time
+
+
+# Detection settings from best to cheapest, as (upsample, scale)
+DETECT_OPTIONS = ((1, 1.0), (0, 1.0), (0, 0.75), (0, 0.5))
+# Fewer trials than this are not worth starting a vault search for
+MIN_TRIALS = 50
+
+
+class FrameGovernor:
+    """Decide per frame how much work still fits before the deadline.
+
+    Stage costs are tracked as moving averages. Detection cost is kept
+    normalized to one full size pass without upsampling, so the cost of
+    any (upsample, scale) option can be estimated from it. After each
+    processed frame the loop idles long enough to keep its CPU share
+    at governor.max_cpu_share.
+    """
+
+    def __init__(self, config, start_time, timeout, max_upsample=1, max_trials=5000):
+        self.deadline = start_time + timeout
+        self.reserve = config.getfloat("governor", "reserve", fallback=0.1)
+        self.max_cpu_share = min(1.0, max(0.05, config.getfloat("governor", "max_cpu_share", fallback=1.0)))
+        self.min_scale = config.getfloat("governor", "min_scale", fallback=0.5)
+        self.max_upsample = max_upsample
+        self.max_trials = max_trials
+
+        self.costs = {}
+        self.resume_at = 0.0
+        self.frame_started = None
+        self.processed = 0
+        self.skipped = 0
+        self.cpu_start = time.process_time()
+
+    def remaining(self):
+        return self.deadline - time.time() - self.reserve
+
+    def record(self, stage, seconds):
+        previous = self.costs.get(stage)
+        self.costs[stage] = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+
+    def record_detect(self, seconds, upsample, scale):
+        # Upsampling doubles both sides of the image
+        self.record("detect", seconds / (scale * scale * (4 if upsample else 1)))
+
+    def should_skip(self):
+        """True if this frame should be dropped to respect the CPU share"""
+        if time.time() < self.resume_at:
+            self.skipped += 1
+            return True
+        return False
+
+    def begin_frame(self):
+        """Pick (upsample, scale) for the next detection, or None if no frame fits anymore"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            return None
+
+        self.frame_started = time.time()
+        fixed = self.costs.get("landmarks", 0) + self.costs.get("encode", 0) + MIN_TRIALS * self.costs.get("trial", 0)
+        options = [
+            (upsample, scale) for upsample, scale in DETECT_OPTIONS
+            if upsample <= self.max_upsample and scale >= self.min_scale
+        ]
+
+        def estimate(option):
+            upsample, scale = option
+            return self.costs.get("detect", 0) * scale * scale * (4 if upsample else 1) + fixed
+
+        # Best option that leaves room for another frame, else the cheapest one that still fits
+        for option in options:
+            if estimate(option) <= remaining / 2:
+                return option
+        if estimate(options[-1]) <= remaining:
+            return options[-1]
+        return None
+
+    def end_frame(self):
+        self.processed += 1
+        if self.frame_started is not None and self.max_cpu_share < 1.0:
+            busy = time.time() - self.frame_started
+            self.resume_at = self.frame_started + busy / self.max_cpu_share
+
+    def trials_budget(self, models=1):
+        """Trials per model that can still run before the deadline"""
+        per_trial = self.costs.get("trial")
+        if per_trial is None:
+            return self.max_trials
+        trials = int(self.remaining() / (per_trial * max(1, models)))
+        trials = min(self.max_trials, trials)
+        return trials if trials >= MIN_TRIALS else 0
+
+    def cpu_time(self):
+        """CPU used since the loop started by all threads of the process.
+
+        This includes the feedback thread and dlib's worker threads, and
+        under pam_mfa_auth also the voice pipeline running alongside.
+        """
+        return time.process_time() - self.cpu_start
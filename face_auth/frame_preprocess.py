@@ -0,0 +1,75 @@
+# Frame preprocessing shared by ref_face and pam_face_auth
+import cv2
+import numpy as np
+
+
+# Pixels below this value fall into the first of 8 histogram bins, which is what counts as dark
+DARK_LEVEL = 256 // 8
+
+
+class FramePreprocessor:
+    """Turn recorder frames into the detector input without per frame allocations.
+
+    Dark frames are rejected from a subsampled view of the raw grayscale
+    frame before anything else is done with them. Frames that pass get
+    CLAHE into one of `slots` preallocated buffers, so callers that batch
+    frames (see FaceDetector.batch_size) can hold that many results at once.
+
+    Older versions measured darkness after CLAHE, which brightens dim
+    frames, so the same video.dark_threshold now rejects more frames from
+    dim or IR cameras; `bm_auth face calibrate` picks a threshold from the
+    raw measurement.
+    """
+
+    def __init__(self, config, slots=1):
+        self.clahe = cv2.createCLAHE(
+            clipLimit=config.getfloat("clahe", "clip_limit", fallback=2.0),
+            tileGridSize=(config.getint("clahe", "tile_grid_size", fallback=8),) * 2
+        )
+        self.dark_threshold = config.getfloat("video", "dark_threshold", fallback=60)
+        self.sample_step = max(1, config.getint("video", "dark_sample_step", fallback=4))
+        self.slots = max(1, slots)
+
+        self.shape = None
+        self.gray = None
+        self.mask = None
+        self.enhanced = []
+        self.next_slot = 0
+
+        self.last_darkness = 0.0
+        self.dark_frames = 0
+
+    def _allocate(self, shape):
+        self.shape = shape
+        self.gray = np.empty(shape, dtype=np.uint8)
+        self.mask = np.empty_like(self.gray[::self.sample_step, ::self.sample_step], dtype=bool)
+        self.enhanced = [np.empty(shape, dtype=np.uint8) for _ in range(self.slots)]
+
+    def process(self, frame, gsframe=None):
+        """Return the CLAHE enhanced grayscale frame, or None for a dark frame.
+
+        The returned array is reused after `slots` more calls.
+        """
+        shape = frame.shape[:2]
+        if shape != self.shape:
+            self._allocate(shape)
+
+        # The recorder usually converted the frame already
+        if gsframe is not None and gsframe.ndim == 2 and gsframe.shape == shape:
+            gray = gsframe
+        elif frame.ndim == 2:
+            gray = frame
+        else:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        sample = gray[::self.sample_step, ::self.sample_step]
+        np.less(sample, DARK_LEVEL, out=self.mask)
+        self.last_darkness = np.count_nonzero(self.mask) * 100 / self.mask.size
+
+        if self.last_darkness > self.dark_threshold:
+            self.dark_frames += 1
+            return None
+
+        enhanced = self.enhanced[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % self.slots
+        return self.clahe.apply(gray, dst=enhanced)
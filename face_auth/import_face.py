@@ -0,0 +1,225 @@
+# Import face models for many users at once from a directory of images
+#
+# Expected layout, images with the same file name (without extension) in the
+# direction folders form one group, like one run of "bm_auth face add":
+#   DIR/<user>/Front/<name>.jpg
+#   DIR/<user>/Left/<name>.jpg
+#   DIR/<user>/Right/<name>.jpg
+# A name that is missing in some direction gives a group without that direction.
+import os
+import sys
+import pwd
+import json
+import time
+import tempfile
+import configparser
+import builtins
+import multiprocessing
+import numpy as np
+
+# Try to import dlib and give a nice error if we can't
+try:
+    import dlib
+except ImportError as err:
+    print(err)
+    print("Can't import the dlib module, check the output of")
+    print("pip3 show dlib")
+    sys.exit(1)
+
+# OpenCV needs to be imported after dlib
+import cv2
+from vault_utils import deterministic_secret_from_biometric, create_vault_from_coeffs
+from face_detection import FaceDetector
+import resource_cache
+
+
+MODELS_DIR = "/usr/local/etc/bm_auth/face_auth/models"
+DIRECTIONS = ("Front", "Left", "Right")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Per worker models, loaded once by init_worker
+face_detector = None
+pose_predictor = None
+face_encoder = None
+clahe = None
+
+
+def init_worker(config):
+    global face_detector, pose_predictor, face_encoder, clahe
+
+    face_detector = FaceDetector(config)
+
+    pose_predictor = dlib.shape_predictor("/usr/local/share/dlib-data/shape_predictor_68_face_landmarks.dat")
+    face_encoder = dlib.face_recognition_model_v1("/usr/local/share/dlib-data/dlib_face_recognition_resnet_model_v1.dat")
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+
+def encode_image(task):
+    """Build a vault from one image, return (task, vault, error)"""
+    user, direction, name, path = task
+
+    # One bad image must not abort the import and lose the images already processed
+    try:
+        frame = cv2.imread(path)
+        if frame is None:
+            return task, None, "could not read image"
+
+        gsframe = clahe.apply(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        face_locations = face_detector.detect([gsframe], 1)[0]
+
+        if not face_locations:
+            return task, None, "no face detected"
+        if len(face_locations) > 1:
+            return task, None, "multiple faces detected"
+
+        face_landmark = pose_predictor(frame, face_locations[0])
+        face_encoding = np.array(face_encoder.compute_face_descriptor(frame, face_landmark, 1))
+        face_encoding /= np.linalg.norm(face_encoding)
+
+        local_coeffs = deterministic_secret_from_biometric(face_encoding)
+        vault = create_vault_from_coeffs(local_coeffs, face_encoding.tolist())
+        return task, vault, None
+    except Exception as err:
+        return task, None, f"{type(err).__name__}: {err}"
+
+
+def collect_tasks(source_dir):
+    tasks = []
+    for user in sorted(os.listdir(source_dir)):
+        user_dir = os.path.join(source_dir, user)
+        if not os.path.isdir(user_dir):
+            continue
+
+        if user == "root":
+            print(f"Skipping {user_dir}: models for root are not allowed")
+            continue
+
+        try:
+            pwd.getpwnam(user)
+        except KeyError:
+            print(f"Skipping {user_dir}: no such user")
+            continue
+
+        for direction in DIRECTIONS:
+            direction_dir = os.path.join(user_dir, direction)
+            if not os.path.isdir(direction_dir):
+                continue
+
+            seen = {}
+            for image in sorted(os.listdir(direction_dir)):
+                name, ext = os.path.splitext(image)
+                if ext.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                if name in seen:
+                    print(f"Skipping {os.path.join(direction_dir, image)}: same name as {seen[name]}")
+                    continue
+                seen[name] = image
+                tasks.append((user, direction, name, os.path.join(direction_dir, image)))
+
+    return tasks
+
+
+def write_models_atomic(enc_file, encodings):
+    # Write next to the target and rename, so PAM never reads a half written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(enc_file), prefix=".import-")
+    try:
+        with os.fdopen(fd, "w") as datafile:
+            json.dump(encodings, datafile)
+            datafile.flush()
+            os.fsync(datafile.fileno())
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, enc_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_user_models(user, vaults):
+    enc_file = os.path.join(MODELS_DIR, f"{user}.dat")
+
+    # Load existing encodings
+    try:
+        encodings = json.load(open(enc_file))
+    except FileNotFoundError:
+        encodings = []
+
+    next_id = encodings[-1]["id"] + 1 if encodings else 0
+    group_number = next_id // 3
+    now = int(time.time())
+    added = 0
+
+    # Images sharing a file name become one group, like one run of "bm_auth face add"
+    for name in sorted({name for name, _ in vaults}):
+        for direction in DIRECTIONS:
+            vault = vaults.get((name, direction))
+            if vault is None:
+                continue
+
+            encodings.append({
+                "time": now,
+                "label": f"Imported Model #{group_number} ({direction})",
+                "id": next_id,
+                "vault": vault
+            })
+            next_id += 1
+            added += 1
+        group_number += 1
+
+    write_models_atomic(enc_file, encodings)
+    resource_cache.invalidate(enc_file)
+    return added
+
+
+def main():
+    if not builtins.bm_args.arguments:
+        print("Please add the directory with the images to import as an argument")
+        print("For example:")
+        print("\n\tbm_auth face import /srv/id_photos [JOBS]\n")
+        sys.exit(1)
+
+    source_dir = builtins.bm_args.arguments[0]
+    if not os.path.isdir(source_dir):
+        print(f"Directory does not exist: {source_dir}")
+        sys.exit(1)
+
+    jobs = os.cpu_count() or 1
+    if len(builtins.bm_args.arguments) > 1:
+        jobs = int(builtins.bm_args.arguments[1])
+
+    config = configparser.ConfigParser()
+    config.read("/usr/local/etc/bm_auth/face_auth/config.ini")
+
+    tasks = collect_tasks(source_dir)
+    if not tasks:
+        print(f"No images found in {source_dir}")
+        sys.exit(1)
+
+    # Create models folder if needed
+    if not os.path.exists(MODELS_DIR):
+        print("No face model folder found, creating one")
+        os.makedirs(MODELS_DIR)
+
+    print(f"Importing {len(tasks)} images with {jobs} workers")
+
+    results = {}
+    failed = 0
+    start_time = time.time()
+
+    # fork keeps the worker from re-running the bm_auth entry script
+    context = multiprocessing.get_context("fork")
+    with context.Pool(jobs, initializer=init_worker, initargs=(config,)) as pool:
+        for task, vault, error in pool.imap_unordered(encode_image, tasks, chunksize=4):
+            user, direction, name, path = task
+            if error:
+                print(f"Skipping {path}: {error}")
+                failed += 1
+                continue
+            results.setdefault(user, {})[(name, direction)] = vault
+
+    elapsed = time.time() - start_time
+
+    for user, vaults in sorted(results.items()):
+        added = save_user_models(user, vaults)
+        print(f"Added {added} models to {user}")
+
+    print(f"\nProcessed {len(tasks)} images in {elapsed:.1f}s ({len(tasks) / elapsed:.1f} images/s), {failed} skipped")
@@ -4,6 +4,7 @@ import os
 import json
 import time
 import builtins
+from auth_stats import AuthStats
 
 
 user = builtins.bm_user
@@ -25,9 +26,12 @@ except FileNotFoundError:
         print("\n\tsudo bm_auth -U " + user + " add\n")
         sys.exit(1)
 
+# Authentication history, to show how often each model unlocks
+stats = AuthStats.load(user)
+
 # Print a header
 print("Known face models for {}:".format(user))
-print("\n\033[1;29m" + "ID  Date                 Label\033[0m")
+print("\n\033[1;29m" + "ID  Date                 Hits         Label\033[0m")
 
 # Loop through all encodings and print info about them
 for enc in encodings:
@@ -41,6 +45,13 @@ for enc in encodings:
 
         # Separate with spaces
         print("  ", end="")
+
+        # Hit rate over all logins where the model was tried
+        entry = stats.model(enc["id"])
+        hits = "{}/{}".format(entry["hits"], entry["attempts"])
+        if entry["attempts"]:
+                hits += " {:.0%}".format(entry["hits"] / entry["attempts"])
+        print(hits.ljust(13), end="")
     
     # End with the label
         print(enc["label"])
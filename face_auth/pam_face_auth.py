@@ -1,128 +1,253 @@
 # pam_face_auth.py — PAM совместимая версия аутентификации через Fuzzy Vault
 import sys
-import json
+import syslog
 import time
 import math
 import numpy as np
 import cv2
 import dlib
-import configparser
 import random
 
 
-# PAM interface
-def pam_sm_authenticate(pamh, flags, argv):
+def authenticate_face(pamh, user, cancel=None):
+    """Run the face pipeline for user and return a PAM status code.
+
+    cancel is an optional threading.Event; once it is set the pipeline stops
+    before the next frame and returns PAM_AUTH_ERR.
+    """
+    sys.path.append("/usr/local/lib/x86_64-linux-gnu/howdy")
+    from recorders.video_capture import VideoCapture
+    from vault_utils import unlock_vault, UnlockCache
+    from face_detection import FaceDetector
+    from frame_preprocess import FramePreprocessor
+    from pam_feedback import PamFeedback
+    from auth_stats import AuthStats
+    from frame_governor import FrameGovernor
+    import resource_cache
+
+    # pam_python may keep this process alive between logins, so setup work is cached
+    config = resource_cache.get_config("/usr/local/etc/bm_auth/face_auth/config.ini")
+
+    face_detector = FaceDetector(config)
+    pose_predictor = resource_cache.get_model(dlib.shape_predictor, "/usr/local/share/dlib-data/shape_predictor_5_face_landmarks.dat")
+    face_encoder = resource_cache.get_model(dlib.face_recognition_model_v1, "/usr/local/share/dlib-data/dlib_face_recognition_resnet_model_v1.dat")
+
     try:
-        sys.path.append("/usr/local/lib/x86_64-linux-gnu/howdy")
-        from recorders.video_capture import VideoCapture
-        from vault_utils import unlock_vault
+        models = resource_cache.get_vaults(f"/usr/local/etc/bm_auth/face_auth/models/{user}.dat")
+    except FileNotFoundError:
+        pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "No face model found for user."))
+        return pamh.PAM_AUTH_ERR
 
-        user = pamh.get_user(None)
-        if not user:
-            return pamh.PAM_USER_UNKNOWN
+    available_directions = []
+    for model in models:
+        if "(Front)" in model["label"]:
+            available_directions.append("Front")
+        if "(Left)" in model["label"]:
+            available_directions.append("Left")
+        if "(Right)" in model["label"]:
+            available_directions.append("Right")
 
-        config = configparser.ConfigParser()
-        config.read("/usr/local/etc/bm_auth/face_auth/config.ini")
+    if not available_directions:
+        pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "No valid face directions found."))
+        return pamh.PAM_AUTH_ERR
 
-        use_cnn = config.getboolean("core", "use_cnn", fallback=False)
-        if use_cnn:
-            face_detector = dlib.cnn_face_detection_model_v1("/usr/local/share/dlib-data/mmod_human_face_detector.dat")
-        else:
-            face_detector = dlib.get_frontal_face_detector()
-
-        pose_predictor = dlib.shape_predictor("/usr/local/share/dlib-data/shape_predictor_5_face_landmarks.dat")
-        face_encoder = dlib.face_recognition_model_v1("/usr/local/share/dlib-data/dlib_face_recognition_resnet_model_v1.dat")
-
-        try:
-            models = json.load(open(f"/usr/local/etc/bm_auth/face_auth/models/{user}.dat"))
-        except FileNotFoundError:
-            pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "No face model found for user."))
-            return pamh.PAM_AUTH_ERR
-
-        available_directions = []
-        for model in models:
-            if "(Front)" in model["label"]:
-                available_directions.append("Front")
-            if "(Left)" in model["label"]:
-                available_directions.append("Left")
-            if "(Right)" in model["label"]:
-                available_directions.append("Right")
-
-        if not available_directions:
-            pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "No valid face directions found."))
-            return pamh.PAM_AUTH_ERR
-
-        selected_direction = random.choice(available_directions)
-        direction_messages = {
-            "Front": "Please look straight into the camera",
-            "Left": "Please turn your head to the LEFT",
-            "Right": "Please turn your head to the RIGHT"
-        }
-
-        pamh.conversation(pamh.Message(pamh.PAM_TEXT_INFO, direction_messages[selected_direction]))
+    selected_direction = random.choice(available_directions)
+    direction_messages = {
+        "Front": "Please look straight into the camera",
+        "Left": "Please turn your head to the LEFT",
+        "Right": "Please turn your head to the RIGHT"
+    }
+
+    pamh.conversation(pamh.Message(pamh.PAM_TEXT_INFO, direction_messages[selected_direction]))
+
+    # Give the user time to turn, but wake up early if the caller gave up
+    if cancel is None:
         time.sleep(2)
+    elif cancel.wait(2):
+        return pamh.PAM_AUTH_ERR
 
-        target_models = [m for m in models if f"({selected_direction})" in m["label"]]
-        if not target_models:
-            pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, f"No models for direction: {selected_direction}"))
-            return pamh.PAM_AUTH_ERR
-
-        def get_head_pose(landmarks):
-            left_eye = np.array([landmarks.part(2).x, landmarks.part(2).y])
-            right_eye = np.array([landmarks.part(0).x, landmarks.part(0).y])
-            nose = np.array([landmarks.part(4).x, landmarks.part(4).y])
-            eye_center = (left_eye + right_eye) / 2
-            head_axis = nose - eye_center
-            angle_rad = math.atan2(head_axis[1], head_axis[0])
-            return math.degrees(angle_rad)
-
-        def is_head_position_correct(angle_deg, expected):
-            threshold = 15
-            if expected == "Front":
-                return 90 - threshold <= angle_deg <= 90 + threshold
-            elif expected == "Left":
-                return angle_deg < 90 - threshold
-            elif expected == "Right":
-                return angle_deg > 90 + threshold
-            return False
-
-        video_capture = VideoCapture(config)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        start_time = time.time()
-        timeout = config.getint("video", "timeout", fallback=5)
-        frame_id = 0
+    target_models = [m for m in models if f"({selected_direction})" in m["label"] and "vault" in m]
+    if not target_models:
+        pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, f"No models for direction: {selected_direction}"))
+        return pamh.PAM_AUTH_ERR
 
-        while time.time() - start_time < timeout:
-            frame, gsframe = video_capture.read_frame()
-            if frame is None:
-                continue
+    # Try the models that unlocked most often first, and spend less on those that never do
+    stats = AuthStats.load(user)
+    target_models = stats.order(target_models)
+    peer_ids = [m["id"] for m in target_models]
+    tried_ids = set()
+    cancelled = False
+    hit_id = None
+    hit_trials = 0
 
-            frame_id += 1
-            gsframe = clahe.apply(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
-            face_locations = face_detector(gsframe, 1)
+    def get_head_pose(landmarks):
+        left_eye = np.array([landmarks.part(2).x, landmarks.part(2).y])
+        right_eye = np.array([landmarks.part(0).x, landmarks.part(0).y])
+        nose = np.array([landmarks.part(4).x, landmarks.part(4).y])
+        eye_center = (left_eye + right_eye) / 2
+        head_axis = nose - eye_center
+        angle_rad = math.atan2(head_axis[1], head_axis[0])
+        return math.degrees(angle_rad)
+
+    def is_head_position_correct(angle_deg, expected):
+        threshold = 15
+        if expected == "Front":
+            return 90 - threshold <= angle_deg <= 90 + threshold
+        elif expected == "Left":
+            return angle_deg < 90 - threshold
+        elif expected == "Right":
+            return angle_deg > 90 + threshold
+        return False
+
+    video_capture = VideoCapture(config)
+    preprocessor = FramePreprocessor(config, slots=face_detector.cnn_batch_size)
+    start_time = time.time()
+    timeout = config.getint("video", "timeout", fallback=5)
+    upsample = config.getint("core", "upsample", fallback=1)
+    trials = config.getint("vault", "trials", fallback=5000)
+    # Unset means the smallest pool that the trial budget can cover
+    top_k = config.getint("vault", "top_k", fallback=None)
+    frame_id = 0
+    buffered = []
+
+    # Similar frames often give the same candidate points, remember failures
+    unlock_cache = UnlockCache(maxsize=config.getint("vault", "cache_size", fallback=256))
+
+    # Scales the work per frame down so the loop ends by its deadline
+    governor = FrameGovernor(config, start_time, timeout, max_upsample=upsample, max_trials=trials)
+
+    # Head pose hints go through a background channel so the loop never waits on PAM
+    feedback = PamFeedback(pamh, min_interval=config.getfloat("feedback", "min_interval", fallback=0.5))
+
+    def process_batch(batch):
+        """Detect faces in the buffered frames and try to unlock.
+
+        Returns True on success, None once no frame fits before the deadline.
+        """
+        nonlocal hit_id, hit_trials
+
+        # Stop early rather than overrun the deadline with a frame that can't finish
+        plan = governor.begin_frame()
+        if plan is None:
+            return None
+        frame_upsample, scale = plan
+
+        images = [gs for _, gs in batch]
+        if scale < 1.0:
+            images = [cv2.resize(gs, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) for gs in images]
+
+        stage_start = time.perf_counter()
+        detections = face_detector.detect(images, frame_upsample)
+        governor.record_detect((time.perf_counter() - stage_start) / len(images), frame_upsample, scale)
 
+        for (frame, _), face_locations in zip(batch, detections):
             for fl in face_locations:
-                if use_cnn:
-                    fl = fl.rect
+                if scale < 1.0:
+                    fl = dlib.rectangle(int(fl.left() / scale), int(fl.top() / scale),
+                                        int(fl.right() / scale), int(fl.bottom() / scale))
 
+                stage_start = time.perf_counter()
                 face_landmark = pose_predictor(frame, fl)
+                governor.record("landmarks", time.perf_counter() - stage_start)
                 angle_deg = get_head_pose(face_landmark)
 
                 if not is_head_position_correct(angle_deg, selected_direction):
-                    pamh.conversation(pamh.Message(pamh.PAM_TEXT_INFO, f"[INFO] ❌ Head position not valid for '{selected_direction}'."))
+                    feedback.send(pamh.PAM_TEXT_INFO, f"[INFO] ❌ Head position not valid for '{selected_direction}'.")
                     continue
 
+                stage_start = time.perf_counter()
                 face_encoding = np.array(face_encoder.compute_face_descriptor(frame, face_landmark, 1))
                 face_encoding /= np.linalg.norm(face_encoding)
+                governor.record("encode", time.perf_counter() - stage_start)
 
                 for model in target_models:
-                    if "vault" in model:
-                        result = unlock_vault(model["vault"], face_encoding.tolist())
-                        if result:
-                            return pamh.PAM_SUCCESS
+                    model_trials = stats.trials_for(model["id"], governor.trials_budget(len(target_models)), peer_ids)
+                    if not model_trials:
+                        continue
 
-        pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "Face authentication failed."))
-        return pamh.PAM_AUTH_ERR
+                    tried_ids.add(model["id"])
+                    stage_start = time.perf_counter()
+                    unlocked, trials_run = unlock_vault(model["vault"], face_encoding.tolist(),
+                                                        trials=model_trials, top_k=top_k, cache=unlock_cache)
+                    if unlocked:
+                        hit_id, hit_trials = model["id"], trials_run
+                        return True
+
+                    # Cache hits run no trials and would skew the per trial estimate
+                    if trials_run:
+                        governor.record("trial", (time.perf_counter() - stage_start) / trials_run)
+
+        governor.end_frame()
+        return False
+
+    try:
+        while time.time() - start_time < timeout:
+            # The caller already has its answer, buffered frames can't change it
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                return pamh.PAM_AUTH_ERR
+
+            frame, gsframe = video_capture.read_frame()
+            if frame is None:
+                continue
+
+            frame_id += 1
+            if governor.should_skip():
+                continue
+
+            gsframe = preprocessor.process(frame, gsframe)
+            if gsframe is None:
+                continue
+
+            # The CNN detector runs on several frames at once
+            buffered.append((frame, gsframe))
+            if len(buffered) < face_detector.batch_size:
+                continue
+
+            batch, buffered = buffered, []
+            outcome = process_batch(batch)
+            if outcome:
+                return pamh.PAM_SUCCESS
+            if outcome is None:
+                break
+        else:
+            # Timed out with a partial CNN batch still buffered
+            if buffered and process_batch(buffered):
+                return pamh.PAM_SUCCESS
+    finally:
+        video_capture.release()
+        # Hints are stale once the user is authenticated
+        feedback.close(flush=hit_id is None)
+
+        # A cancelled run says nothing about the models
+        if tried_ids and not cancelled:
+            stats.record(selected_direction, tried_ids, hit_id, hit_trials, frame_id)
+            try:
+                stats.save()
+            except OSError:
+                pass
+
+        loop_time = time.time() - start_time
+        syslog.syslog(syslog.LOG_AUTH | syslog.LOG_DEBUG,
+                      f"bm_auth face: user={user} frames={frame_id} processed={governor.processed} "
+                      f"skipped={governor.skipped} loop={loop_time:.2f}s cpu={governor.cpu_time():.2f}s "
+                      f"conversation={feedback.io_time:.3f}s (in loop {feedback.send_time:.4f}s, "
+                      f"sent {feedback.sent}, collapsed {feedback.collapsed}) "
+                      f"unlock_cache hits={unlock_cache.hits} misses={unlock_cache.misses} "
+                      f"resource_cache hits={resource_cache.hits} misses={resource_cache.misses}")
+
+    pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, "Face authentication failed."))
+    return pamh.PAM_AUTH_ERR
+
+
+# PAM interface
+def pam_sm_authenticate(pamh, flags, argv):
+    try:
+        user = pamh.get_user(None)
+        if not user:
+            return pamh.PAM_USER_UNKNOWN
+
+        return authenticate_face(pamh, user)
 
     except Exception as e:
         pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, f"Error: {str(e)}"))
@@ -0,0 +1,89 @@
+# Non-blocking PAM conversation channel for messages sent from the frame loop
+import time
+import threading
+
+
+class PamFeedback:
+    """Deliver PAM messages from a background thread at a bounded rate.
+
+    send() never waits for the PAM conversation. Only the newest pending
+    message is kept, a message is never delivered sooner than min_interval
+    after the previous one, and a repeat of the last delivered text is
+    dropped for repeat_interval seconds.
+    """
+
+    def __init__(self, pamh, min_interval=0.5, repeat_interval=3.0):
+        self.pamh = pamh
+        self.min_interval = min_interval
+        self.repeat_interval = repeat_interval
+
+        self.cond = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.last_text = None
+        self.last_sent = 0.0
+
+        # Time spent in pamh.conversation by the worker, and in send() by the caller
+        self.io_time = 0.0
+        self.send_time = 0.0
+        self.sent = 0
+        self.collapsed = 0
+
+        self.thread = threading.Thread(target=self._run, name="bm_auth-feedback", daemon=True)
+        self.thread.start()
+
+    def send(self, style, text):
+        start = time.perf_counter()
+        with self.cond:
+            repeat = text == self.last_text and time.monotonic() - self.last_sent < self.repeat_interval
+            if repeat or (self.pending is not None and self.pending[1] == text):
+                self.collapsed += 1
+            else:
+                if self.pending is not None:
+                    self.collapsed += 1
+                self.pending = (style, text)
+                self.cond.notify()
+        self.send_time += time.perf_counter() - start
+
+    def close(self, flush=True):
+        """Stop the worker, delivering the pending message first if flush is set.
+
+        Waits for a conversation already in progress, like a direct call
+        would, so nothing reaches pamh once the caller has returned.
+        """
+        with self.cond:
+            if not flush and self.pending is not None:
+                self.pending = None
+                self.collapsed += 1
+            self.closed = True
+            self.cond.notify()
+
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+
+                # Hold the message back until the rate limit allows it, unless we are closing
+                while not self.closed:
+                    remaining = self.last_sent + self.min_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                if self.pending is None:
+                    return
+                style, text = self.pending
+                self.pending = None
+                self.last_text = text
+                self.last_sent = time.monotonic()
+
+            start = time.perf_counter()
+            try:
+                self.pamh.conversation(self.pamh.Message(style, text))
+            except Exception:
+                pass
+            self.io_time += time.perf_counter() - start
+            self.sent += 1
@@ -19,17 +19,17 @@ except ImportError as err:
 # OpenCV needs to be imported after dlib
 import cv2
 from vault_utils import deterministic_secret_from_biometric, create_vault_from_coeffs
+from face_detection import FaceDetector
+from frame_preprocess import FramePreprocessor
+import resource_cache
 
 
 # Read config from disk
 config = configparser.ConfigParser()
 config.read("/usr/local/etc/bm_auth/face_auth/config.ini")
 
-use_cnn = config.getboolean("core", "use_cnn", fallback=False)
-if use_cnn:
-    face_detector = dlib.cnn_face_detection_model_v1("/usr/local/share/dlib-data/mmod_human_face_detector.dat")
-else:
-    face_detector = dlib.get_frontal_face_detector()
+face_detector = FaceDetector(config)
+preprocessor = FramePreprocessor(config)
 
 pose_predictor = dlib.shape_predictor("/usr/local/share/dlib-data/shape_predictor_68_face_landmarks.dat")
 face_encoder = dlib.face_recognition_model_v1("/usr/local/share/dlib-data/dlib_face_recognition_resnet_model_v1.dat")
@@ -93,25 +93,18 @@ for idx, direction in enumerate(directions):
     while frames < 60:
         frames += 1
         frame, gsframe = video_capture.read_frame()
-        gsframe = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gsframe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8)).apply(gsframe)
 
-        # Darkness calculation
-        hist = cv2.calcHist([gsframe], [0], None, [8], [0, 256])
-        hist_total = np.sum(hist)
-        if hist_total == 0:
-            continue
-
-        darkness = (hist[0] / hist_total * 100)
-        dark_running_total += darkness
+        # Dark frames are rejected before CLAHE and detection
+        gsframe = preprocessor.process(frame, gsframe)
+        dark_running_total += preprocessor.last_darkness
         valid_frames += 1
 
-        if darkness > config.getfloat("video", "dark_threshold", fallback=60):
+        if gsframe is None:
             dark_tries += 1
             continue
 
         # Face detection
-        face_locations = face_detector(gsframe, 1)
+        face_locations = face_detector.detect([gsframe], config.getint("core", "upsample", fallback=1))[0]
         if face_locations:
             break
 
@@ -125,8 +118,7 @@ for idx, direction in enumerate(directions):
         sys.exit(1)
 
     # Face encoding
-    face_location = face_locations[0].rect if use_cnn else face_locations[0]
-    face_landmark = pose_predictor(frame, face_location)
+    face_landmark = pose_predictor(frame, face_locations[0])
     face_encoding = np.array(face_encoder.compute_face_descriptor(frame, face_landmark, 1))
     face_encoding /= np.linalg.norm(face_encoding)
 
@@ -150,4 +142,7 @@ for idx, direction in enumerate(directions):
 with open(enc_file, "w") as datafile:
     json.dump(encodings, datafile)
 
+# Let running PAM hosts reload the vaults
+resource_cache.invalidate(enc_file)
+
 print("Added 3 models (Group #{}) to {}".format(group_number, user))
@@ -0,0 +1,88 @@
+# In-process cache of models, config and vaults for long lived pam_python hosts
+import os
+import json
+import tempfile
+import threading
+import configparser
+
+
+MODELS_DIR = "/usr/local/etc/bm_auth/face_auth/models"
+
+# Replaced by invalidate() whenever a tool writes a models file. Timestamps
+# alone can miss two writes that land within the filesystem's time granularity.
+GENERATION_FILE = os.path.join(MODELS_DIR, ".generation")
+
+_entries = {}
+_lock = threading.Lock()
+
+hits = 0
+misses = 0
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _stamp(path):
+    if os.path.dirname(os.path.abspath(path)) == MODELS_DIR:
+        return _file_stamp(path), _file_stamp(GENERATION_FILE)
+    return _file_stamp(path)
+
+
+def cached(kind, path, loader):
+    """Return loader(path), reusing the previous result while the file is unchanged"""
+    global hits, misses
+
+    key = (kind, path)
+    stamp = _stamp(path)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            hits += 1
+            return entry[1]
+        misses += 1
+
+    value = loader(path)
+    with _lock:
+        _entries[key] = (stamp, value)
+    return value
+
+
+def get_config(path):
+    """Parsed config.ini, callers must not modify it"""
+    def load(path):
+        config = configparser.ConfigParser()
+        config.read(path)
+        return config
+    return cached("config", path, load)
+
+
+def get_model(factory, path):
+    """dlib model built by factory(path), e.g. get_model(dlib.shape_predictor, path)"""
+    return cached(getattr(factory, "__name__", repr(factory)), path, factory)
+
+
+def get_vaults(path):
+    """Parsed models file of a user, raises FileNotFoundError like json.load(open(path))"""
+    def load(path):
+        with open(path) as datafile:
+            return json.load(datafile)
+    return cached("vaults", path, load)
+
+
+def invalidate(path=None):
+    """Forget cached entries for path (or all of them) and tell other processes"""
+    with _lock:
+        for key in list(_entries):
+            if path is None or key[1] == path:
+                del _entries[key]
+
+    if path is None or os.path.dirname(os.path.abspath(path)) == MODELS_DIR:
+        # A new inode on every call, so the stamp always changes
+        fd, tmp_path = tempfile.mkstemp(dir=MODELS_DIR, prefix=".generation-")
+        os.close(fd)
+        os.replace(tmp_path, GENERATION_FILE)
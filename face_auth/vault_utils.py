@@ -1,15 +1,24 @@
 import random
 import hashlib
+from math import comb
+from collections import OrderedDict
 import numpy as np
 
 
 PRIME = 2**31 - 1
+# Genuine points per vault, vault creation and unlock must chunk the encoding the same way.
+# A 128-d descriptor gives 32 chunks of 4 values.
+POINT_COUNT = 32
+# Degree of the secret polynomial. Unlocking needs DEGREE + 2 chunks that match
+# the enrolled ones exactly, so up to POINT_COUNT - DEGREE - 2 chunks may differ.
+DEGREE = 24
 
-def vector_to_x(vs: list[float]) -> int:
+def vector_to_x(vs: list[float], index=0) -> int:
     vs = np.array(vs)
     binary_pattern = ''.join(['1' if v > 0 else '0' for v in vs])
     vec_bytes = bytes([int(binary_pattern[i:i+8], 2) for i in range(0, len(binary_pattern), 8)])
-    return int.from_bytes(hashlib.sha256(vec_bytes).digest(), "big") % PRIME
+    # The chunk index keeps equal bit patterns of different chunks from sharing an x
+    return int.from_bytes(hashlib.sha256(bytes([index]) + vec_bytes).digest(), "big") % PRIME
 
 def serialize_coeffs(coeffs):
     return b''.join(c.to_bytes(8, 'big') for c in coeffs)
@@ -67,16 +76,67 @@ def lagrange_interpolate(points, p=PRIME):
 
     return coeffs
 
-def deterministic_secret_from_biometric(encoding):
+def newton_extend(rows, xs, x, y, p=PRIME):
+    """Add the point (x, y) to a divided difference table.
+
+    rows[k] holds f[x_k], f[x_k-1, x_k], ..., f[x_0..x_k], so a new point
+    only needs the last row and costs O(k) instead of a full rebuild.
+    """
+    k = len(rows)
+    row = [y % p]
+    for j in range(1, k + 1):
+        diff = (x - xs[k - j]) % p
+        row.append((row[j - 1] - rows[k - 1][j - 1]) * pow(diff, -1, p) % p)
+    rows.append(row)
+    xs.append(x)
+
+def newton_to_coeffs(rows, xs, p=PRIME):
+    n = len(rows)
+    coeffs = [rows[n - 1][n - 1]]
+    for k in range(n - 2, -1, -1):
+        # coeffs = coeffs * (X - x_k) + c_k
+        shifted = [0] + coeffs
+        for i in range(len(coeffs)):
+            shifted[i] = (shifted[i] - coeffs[i] * xs[k]) % p
+        shifted[0] = (shifted[0] + rows[k][k]) % p
+        coeffs = shifted
+    return coeffs
+
+def combinations_with_change(n, r):
+    """Same order as itertools.combinations(range(n), r), but also yields
+    the first position that differs from the previous combination."""
+    if r > n:
+        return
+    indices = list(range(r))
+    yield 0, indices
+    while True:
+        for i in reversed(range(r)):
+            if indices[i] != i + n - r:
+                break
+        else:
+            return
+        indices[i] += 1
+        for j in range(i + 1, r):
+            indices[j] = indices[j - 1] + 1
+        yield i, indices
+
+def pool_size_for(trials, degree=DEGREE):
+    """Smallest top_k whose candidate subsets can use up the trial budget"""
+    top_k = degree + 2
+    while comb(top_k, degree + 2) < trials:
+        top_k += 1
+    return top_k
+
+def deterministic_secret_from_biometric(encoding, degree=DEGREE):
     N = min(128, len(encoding))
     vs = np.array(encoding[:N])
     binary_pattern = ''.join(['1' if v > 0 else '0' for v in vs])
     seed_data = bytes([int(binary_pattern[i:i+8], 2) for i in range(0, len(binary_pattern), 8)])
     seed_hash = hashlib.sha256(seed_data).digest()
     random.seed(seed_hash)
-    return [random.randint(0, PRIME - 1) for _ in range(33)]  # degree=32
+    return [random.randint(0, PRIME - 1) for _ in range(degree + 1)]
 
-def extract_biometric_points(encoding: list[float], coeffs, point_count=10) -> list[tuple[int, int]]:
+def extract_biometric_points(encoding: list[float], coeffs, point_count=POINT_COUNT) -> list[tuple[int, int]]:
     encoding_len = len(encoding)
     chunk_size = encoding_len // point_count
 
@@ -88,14 +148,21 @@ def extract_biometric_points(encoding: list[float], coeffs, point_count=10) -> l
         start = i * chunk_size
         end = (i + 1) * chunk_size
         chunk = encoding[start:end]
-        x = vector_to_x(chunk)
+        x = vector_to_x(chunk, i)
         y = eval_poly(coeffs, x)
         points.append((x, y))
 
     return points
 
-def create_vault_from_coeffs(coeffs, biometric_data: list[float], chaff_count=100, point_count=68):
+def create_vault_from_coeffs(coeffs, biometric_data: list[float], chaff_count=100, point_count=POINT_COUNT):
+    # search_vault accepts a subset only if degree + 2 points lie on one polynomial
+    degree = len(coeffs) - 1
+    if point_count < degree + 2:
+        raise ValueError(f"point_count={point_count} is smaller than degree + 2 = {degree + 2}, the vault could never be unlocked")
+
     genuine_points = extract_biometric_points(biometric_data, coeffs, point_count=point_count)
+    if len({x for x, _ in genuine_points}) < degree + 2:
+        raise ValueError("Fewer than degree + 2 distinct genuine points, the vault could never be unlocked")
 
     chaff = set()
     while len(chaff) < chaff_count:
@@ -114,7 +181,38 @@ def create_vault_from_coeffs(coeffs, biometric_data: list[float], chaff_count=10
         "hash": hashlib.sha256(serialized).hexdigest()
     }
 
-def unlock_vault(vault, biometric_data: list[float], degree=32, trials=100, point_count=10, top_k=30):
+class UnlockCache:
+    """LRU cache of unlock_vault results for one authentication session.
+
+    Keys are (vault hash, candidate x-values, degree, top_k). A failure is
+    only reused for searches with at most as many trials as the cached one.
+    Hits return (result, 0), no trials ran for them.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, trials):
+        entry = self.entries.get(key)
+        if entry is not None:
+            result, cached_trials = entry
+            if result or cached_trials >= trials:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result, 0
+        self.misses += 1
+        return None
+
+    def put(self, key, trials, result):
+        self.entries[key] = (result, trials)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+def candidate_x_values(biometric_data: list[float], point_count=POINT_COUNT) -> list[int]:
     candidate_points = []
     encoding_len = len(biometric_data)
     chunk_size = encoding_len // point_count
@@ -125,33 +223,104 @@ def unlock_vault(vault, biometric_data: list[float], degree=32, trials=100, poin
         if end > encoding_len or start >= encoding_len:
             break
         chunk = biometric_data[start:end]
-        x_candidate = vector_to_x(chunk)
+        x_candidate = vector_to_x(chunk, i)
         candidate_points.append(x_candidate)
 
+    return candidate_points
+
+def unlock_vault(vault, biometric_data: list[float], degree=DEGREE, trials=5000, point_count=POINT_COUNT, top_k=None, cache=None):
+    """Return (unlocked, trials actually run)"""
+    if top_k is None:
+        top_k = pool_size_for(trials, degree)
+    if top_k < degree + 2:
+        raise ValueError(f"top_k={top_k} is smaller than degree + 2 = {degree + 2}, no subset can be tested")
+
+    candidate_points = candidate_x_values(biometric_data, point_count)
+    if len(candidate_points) < degree + 2:
+        raise ValueError(f"Only {len(candidate_points)} candidate points, degree + 2 = {degree + 2} are needed")
+
+    if cache is not None:
+        key = (vault.get("hash"), tuple(candidate_points), degree, top_k)
+        cached = cache.get(key, trials)
+        if cached is not None:
+            return cached
+        unlocked, trials_run = search_vault(vault, candidate_points, degree, trials, top_k)
+        cache.put(key, trials, unlocked)
+        return unlocked, trials_run
+
+    return search_vault(vault, candidate_points, degree, trials, top_k)
+
+def search_vault(vault, candidate_points, degree=DEGREE, trials=5000, top_k=None):
+    """Return (unlocked, trials actually run).
+
+    Fewer than `trials` run when the pool has fewer subsets than that.
+
+    Every trial takes degree + 2 points. They lie on one polynomial of the
+    given degree exactly when the highest divided difference is zero. That
+    check rejects almost every wrong subset before any coefficients are
+    hashed and needs nothing stored in the vault. create_vault_from_coeffs
+    guarantees enough genuine points for it.
+    """
+    if top_k is None:
+        top_k = pool_size_for(trials, degree)
+
     vault_points = sorted(
         vault.get("points", []),
         key=lambda p: min(abs(p[0] - xc) for xc in candidate_points)
     )[:top_k]
 
-    from itertools import combinations
-    
+    expected_hash = vault.get("hash")
+    size = degree + 2
+
+    # Consecutive subsets share a prefix, so only the points after the first
+    # changed position are pushed into the divided difference table again
+    rows, xs = [], []
     count = 0
-    for subset in combinations(vault_points, degree + 1):
+    for changed, subset in combinations_with_change(len(vault_points), size):
+        if count >= trials:
+            print("Authentication failed after all trials")
+            return False, count
+        count += 1
+
+        del rows[changed:]
+        del xs[changed:]
         try:
-            count += 1
-            if count > trials:
-                return False
-
-            coeffs = lagrange_interpolate(list(subset), PRIME)
-            serialized = serialize_coeffs(coeffs)
-            candidate_hash = hashlib.sha256(serialized).hexdigest()
-            expected_hash = vault.get("hash")
-
-            if candidate_hash == expected_hash:
-                print("Authentication successful!")
-                return True
-        except Exception as e:
+            for i in subset[len(rows):]:
+                x, y = vault_points[i]
+                newton_extend(rows, xs, x, y)
+        except ValueError:
+            # Repeated x in the subset, not invertible
             continue
 
+        # The extra point is not on the polynomial through the others
+        if rows[-1][-1] != 0:
+            continue
+
+        coeffs = newton_to_coeffs(rows[:degree + 1], xs[:degree + 1])
+        candidate_hash = hashlib.sha256(serialize_coeffs(coeffs)).hexdigest()
+
+        if candidate_hash == expected_hash:
+            print("Authentication successful!")
+            return True, count
+
     print("Authentication failed after all trials")
-    return False
+    return False, count
+
+
+if __name__ == "__main__":
+    # Round trip: a vault opens with the encoding it was enrolled from and
+    # with one that differs in as many chunks as DEGREE allows, not with another face
+    encoding = np.random.randn(128)
+    encoding /= np.linalg.norm(encoding)
+    vault = create_vault_from_coeffs(deterministic_secret_from_biometric(encoding), encoding.tolist())
+    assert unlock_vault(vault, encoding.tolist())[0]
+
+    chunk_size = len(encoding) // POINT_COUNT
+    noisy = encoding.copy()
+    for i in range(POINT_COUNT - DEGREE - 2):
+        noisy[i * chunk_size] = -noisy[i * chunk_size]
+    assert unlock_vault(vault, noisy.tolist())[0]
+
+    other = np.random.randn(128)
+    assert not unlock_vault(vault, (other / np.linalg.norm(other)).tolist())[0]
+    print("Round trip OK")
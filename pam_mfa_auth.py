@@ -0,0 +1,127 @@
+# pam_mfa_auth.py — одновременная аутентификация по лицу и голосу в одном PAM модуле
+#
+# Usage in a PAM configuration file:
+#   auth required pam_python.so PATH_TO_FILE/pam_mfa_auth.py [policy=all|any]
+#
+# policy=all  both methods must succeed (default, same as stacking two "required" lines)
+# policy=any  either method is sufficient
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(base_dir, "face_auth"))
+sys.path.insert(0, os.path.join(base_dir, "voice_auth"))
+
+POLICIES = ("all", "any")
+
+
+class LockedPamHandle:
+    """Proxy for pamh that serializes conversation calls between threads"""
+
+    def __init__(self, pamh):
+        self._pamh = pamh
+        self._lock = threading.Lock()
+
+    def conversation(self, *args, **kwargs):
+        with self._lock:
+            return self._pamh.conversation(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pamh, name)
+
+
+def parse_policy(argv):
+    policy = "all"
+    for arg in argv[1:]:
+        key, _, value = arg.partition("=")
+        if key == "policy":
+            policy = value.strip().lower()
+
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy '{policy}', expected one of: {', '.join(POLICIES)}")
+    return policy
+
+
+def run_face(pamh, user, cancel):
+    from pam_face_auth import authenticate_face
+    return authenticate_face(pamh, user, cancel=cancel) == pamh.PAM_SUCCESS
+
+
+def run_voice(pamh, user, cancel):
+    from pam_voice_aith import authenticate_user
+    return authenticate_user(user, pamh=pamh, cancel=cancel)
+
+
+def decide(policy, results):
+    """Return True/False once the policy outcome is known, None while undecided"""
+    if policy == "all":
+        if False in results:
+            return False
+        if len(results) == 2:
+            return True
+    else:
+        if True in results:
+            return True
+        if len(results) == 2:
+            return False
+    return None
+
+
+def authenticate(pamh, user, policy):
+    safe_pamh = LockedPamHandle(pamh)
+    cancel = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="bm_auth") as executor:
+        pending = {
+            executor.submit(run_face, safe_pamh, user, cancel),
+            executor.submit(run_voice, safe_pamh, user, cancel),
+        }
+        results = []
+        outcome = None
+
+        try:
+            while pending and outcome is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        results.append(bool(future.result()))
+                    except Exception as e:
+                        safe_pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, f"Error: {str(e)}"))
+                        results.append(False)
+                outcome = decide(policy, results)
+        finally:
+            # The outcome is known or we are failing, stop the remaining method.
+            # The executor still joins it on exit because pamh must not be used
+            # after we return.
+            cancel.set()
+
+    return bool(outcome)
+
+
+# PAM interface
+def pam_sm_authenticate(pamh, flags, argv):
+    try:
+        policy = parse_policy(argv)
+
+        user = pamh.get_user(None)
+        if not user:
+            return pamh.PAM_USER_UNKNOWN
+
+        if authenticate(pamh, user, policy):
+            return pamh.PAM_SUCCESS
+        return pamh.PAM_AUTH_ERR
+
+    except Exception as e:
+        pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, f"Error: {str(e)}"))
+        return pamh.PAM_SYSTEM_ERR
+
+def pam_sm_setcred(pamh, flags, argv):
+    return pamh.PAM_SUCCESS
+
+exported_functions = {
+    "pam_sm_authenticate": pam_sm_authenticate,
+    "pam_sm_setcred": pam_sm_setcred,
+}
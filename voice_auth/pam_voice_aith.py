@@ -3,6 +3,9 @@ os.environ["PULSE_SERVER"] = "127.0.0.1"
 
 import random
 import json
+import syslog
+import threading
+import configparser
 import numpy as np
 import librosa
 import sounddevice as sd
@@ -22,16 +25,41 @@ if not os.path.exists(VOSK_MODEL_PATH):
 
 vosk_model = Model(VOSK_MODEL_PATH)
 
+# Файл настроек со списком контрольных фраз
+CONFIG_PATH = "/usr/local/etc/bm_auth/voice_auth/config.ini"
+
+# Фразы по умолчанию, если в настройках список не задан
+DEFAULT_PHRASES = [
+    "на заре тихо было на улице",
+    "сегодня хороший день для прогулки",
+    "быстрая река течёт через лес",
+    "ветер шепчет сквозь деревья осенью",
+    "птицы поют ранним утром в саду",
+    "я читаю интересную книгу о путешествиях"
+]
+
+# Распознаватель создаётся один раз и переиспользуется между вызовами
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
 def get_voice_sample(username):
     sample_file = os.path.join(VOICE_SAMPLE_DIR, f"{username}.npy")
     if os.path.exists(sample_file):
         return np.load(sample_file)
     return None
 
-def capture_audio(duration=7, sample_rate=16000):
+def capture_audio(duration=7, sample_rate=16000, cancel=None):
     print("Говорите...")
     audio = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1, dtype='float32')
-    sd.wait()
+    if cancel is None:
+        sd.wait()
+        return np.squeeze(audio)
+
+    # Опрашиваем флаг отмены, чтобы не ждать конца записи впустую
+    while sd.get_stream().active:
+        if cancel.wait(0.1):
+            sd.stop()
+            return None
     return np.squeeze(audio)
 
 def extract_mfcc(audio, sample_rate=16000):
@@ -51,31 +79,52 @@ def compare_mfcc(mfcc1, mfcc2):
     similarity = cosine_similarity(mfcc1, mfcc2)[0][0]
     return similarity
 
+def normalize_phrase(text):
+    # Модель не различает «е» и «ё», сравниваем без учёта этой разницы
+    return " ".join(text.lower().replace("ё", "е").split())
+
+def load_phrases():
+    config = configparser.ConfigParser()
+    config.read(CONFIG_PATH)
+    raw = config.get("challenge", "phrases", fallback="")
+    # В грамматику фразы идут как есть: слова с другим написанием Vosk молча отбрасывает
+    phrases = [line.strip() for line in raw.splitlines() if line.strip()]
+    return phrases or list(DEFAULT_PHRASES)
+
+def warn_unknown_words(phrases):
+    for phrase in phrases:
+        unknown = [word for word in phrase.split() if vosk_model.find_word(word) < 0]
+        if unknown:
+            syslog.syslog(syslog.LOG_AUTH | syslog.LOG_WARNING,
+                          f"bm_auth voice: phrase '{phrase}' has words unknown to the Vosk model: {', '.join(unknown)}")
+
+PHRASES = load_phrases()
+warn_unknown_words(PHRASES)
+
 def generate_random_word():
-    words =  [
-        "на заре тихо было на улице",
-        "сегодня хороший день для прогулки",
-        "быстрая река течёт через лес",
-        "ветер шепчет сквозь деревья осенью",
-        "птицы поют ранним утром в саду",
-        "я читаю интересную книгу о путешествиях"
-    ]
-    return random.choice(words)
+    return random.choice(PHRASES)
+
+def get_recognizer(sample_rate=16000):
+    global _recognizer
+    if _recognizer is None:
+        # Грамматика ограничивает декодер контрольными фразами
+        grammar = json.dumps(PHRASES + ["[unk]"], ensure_ascii=False)
+        _recognizer = KaldiRecognizer(vosk_model, sample_rate, grammar)
+    return _recognizer
 
 def recognize_speech(audio, sample_rate=16000):
-    recognizer = KaldiRecognizer(vosk_model, sample_rate)
     audio_bytes = (audio * 32767).astype('int16').tobytes()
-    if recognizer.AcceptWaveform(audio_bytes):
-        result = json.loads(recognizer.Result())
-        text = result.get("text", "")
-        print(f"Распознанное слово: {text}")
-        return text.strip().lower()
-    else:
-        partial = json.loads(recognizer.PartialResult())
-        print(f"Промежуточный результат: {partial.get('partial', '')}")
-        return None
+    with _recognizer_lock:
+        recognizer = get_recognizer(sample_rate)
+        recognizer.Reset()
+        recognizer.AcceptWaveform(audio_bytes)
+        result = json.loads(recognizer.FinalResult())
+
+    text = result.get("text", "").strip()
+    print(f"Распознанное слово: {text}")
+    return text or None
 
-def authenticate_user(username, pamh=None):
+def authenticate_user(username, pamh=None, cancel=None):
     stored_mfcc = get_voice_sample(username)
     if stored_mfcc is None:
         message = "Образец голоса не найден. Запись нового образца."
@@ -92,11 +141,16 @@ def authenticate_user(username, pamh=None):
     else:
         print(message)
 
-    audio = capture_audio(duration=7)
+    audio = capture_audio(duration=7, cancel=cancel)
+    if audio is None or (cancel is not None and cancel.is_set()):
+        return False
+
     spoken_mfcc = extract_mfcc(audio)
+    if cancel is not None and cancel.is_set():
+        return False
 
     recognized_word = recognize_speech(audio)
-    if recognized_word != expected_word:
+    if recognized_word is None or normalize_phrase(recognized_word) != normalize_phrase(expected_word):
         message = f"Произнесённое слово ('{recognized_word}') не совпадает с ожидаемым ('{expected_word}')."
         if pamh:
             pamh.conversation(pamh.Message(pamh.PAM_ERROR_MSG, message))